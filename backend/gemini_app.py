@@ -1,70 +1,56 @@
-import json
-from langchain_google_genai import GoogleGenerativeAI
 from langchain_core.prompts import PromptTemplate
-from langchain.agents import Tool, initialize_agent, AgentType
-from langchain.memory import ConversationBufferMemory
+from langchain.agents import initialize_agent, AgentType
+from langchain.memory import ConversationSummaryBufferMemory
+from langchain_core.messages import get_buffer_string
 
-from ddgs import DDGS
 from dotenv import load_dotenv
-from datetime import datetime
-from time import sleep
+import sys
+
+from search_tools import CURRENT_YEAR, COMPOSER_TEMPLATE, DDGSearchTool, GeminiLLM, SearchPlanner
 
 load_dotenv()
 
 
-class DDGSearchTool:
-    """DuckDuckGo Search Tool wrapper for LangChain Tool interface."""
-
-    @staticmethod
-    def search(query: str) -> str:
-        sleep(4)  # Rate limiting
-        with DDGS(verify=True) as ddgs:
-            results = ddgs.text(query, max_results=5)
-            if not results:
-                return "No search results found."
-
-            return '\n'.join(
-                f"Title: {result['title']}, Body:{result['body']}, (URL: {result['href']})"
-                for result in results[:5]
-            )
-
-    def to_langchain_tool(self) -> Tool:
-        return Tool.from_function(
-            name="Search",
-            func=self.search,
-            description=(
-                "Useful for finding current or detailed info about PC parts or compatibility. "
-                "Input should be a search query."
-            ),
-        )
+SYSTEM_PROMPT_TEXT = (
+    "You are an experienced PC build assistant.\n"
+    "Must keep in mind that the current year is {year}.\n"
+    "Help users to build their own custom PC using component research.\n"
+    "PC MUST be built within user's budget with the best value-for-money components.\n"
+    "Always search in English language.\n"
+    "Reduce the use of the search tool as much as possible.\n"
+    "Use it only when necessary to look up components or compatibility.\n"
+    "Prefer BatchSearch with all components you still need info on, in a single call.\n\n"
+    "Provide:\n"
+    "- Detailed description of each chosen component.\n"
+    "- Compatibility and performance reasoning.\n"
+    "- Best value-for-money recommendations.\n"
+    "- Exact names of the components and their estimated prices.\n\n"
+    "Conclude with a detailed summary of the selected components.\n"
+)
+
+# Rendered once per process; only the per-call slots are filled in later
+_SYSTEM_TEMPLATE = PromptTemplate.from_template(SYSTEM_PROMPT_TEXT)
+_RENDERED_PREFIX = sys.intern(_SYSTEM_TEMPLATE.format(year=CURRENT_YEAR))
 
+COMPOSER_PROMPT = COMPOSER_TEMPLATE.partial(system_prompt=_RENDERED_PREFIX)
 
-class PCBuildAgent:
+
+class PCBuildAgent(SearchPlanner):
     """Encapsulates the LLM and agent logic for PC building assistance."""
 
+    composer_prompt = COMPOSER_PROMPT
+
     def __init__(self):
-        self.llm = GoogleGenerativeAI(
-            model="gemini-2.5-flash-lite", temperature=1)
-
-        self.tools = [DDGSearchTool().to_langchain_tool()]
-        self.memory = ConversationBufferMemory(
-            memory_key="chat_history", return_messages=True)
-
-        self.system_prompt = (
-            "You are an experienced PC build assistant.\n"
-            f"Must keep in mind that the current year is {datetime.now().year}.\n"
-            "Help users to build their own custom PC using component research.\n"
-            "PC MUST be built within user's budget with the best value-for-money components.\n"
-            "Always search in English language.\n"
-            "Reduce the use of the search tool as much as possible.\n"
-            "Use it only when necessary to look up components or compatibility.\n\n"
-            "Provide:\n"
-            "- Detailed description of each chosen component.\n"
-            "- Compatibility and performance reasoning.\n"
-            "- Best value-for-money recommendations.\n"
-            "- Exact names of the components and their estimated prices.\n\n"
-            "Conclude with a detailed summary of the selected components.\n"
-        )
+        self.llm = GeminiLLM(
+            model="gemini-2.5-flash-lite", temperature=1,
+            request_timeout=20, max_retries=3)
+
+        search_tool = DDGSearchTool()
+        self.batch_tool = search_tool.to_langchain_batch_tool()
+        self.tools = [search_tool.to_langchain_tool(), self.batch_tool]
+        self.memory = ConversationSummaryBufferMemory(
+            llm=self.llm, memory_key="chat_history", return_messages=True,
+            max_token_limit=1500)
 
         self.agent = self._initialize_agent()
 
@@ -72,18 +58,31 @@ class PCBuildAgent:
         return initialize_agent(
             tools=self.tools,
             llm=self.llm,
-            agent_type=AgentType.ZERO_SHOT_REACT_DESCRIPTION,
+            agent=AgentType.ZERO_SHOT_REACT_DESCRIPTION,
             verbose=True,
             handle_parsing_errors=True,
-            max_iterations=30,
+            max_iterations=5,  # Only a fallback when planning fails
             memory=self.memory,
-            agent_kwargs={
-                "system_message": self.system_prompt
-            }
+            # ZERO_SHOT_REACT ignores system_message, the prefix is what reaches the model
+            agent_kwargs={"prefix": _RENDERED_PREFIX}
         )
 
-    def invoke(self, user_input: str) -> str:
-        return self.agent.invoke({"input": user_input})
+    def invoke(self, user_input: str, callbacks: list = None) -> dict:
+        """Answer in at most three LLM calls: plan searches, run them as one batch, compose.
+
+        Falls back to the ReAct agent if the plan cannot be parsed.
+        """
+        config = {"callbacks": callbacks}
+        chat_history = get_buffer_string(self.memory.load_memory_variables({})["chat_history"])
+        try:
+            plan = self._plan(user_input, chat_history, config=config)
+        except ValueError as e:
+            print(f"Planner failed, falling back to agent: {e}")
+            return self.agent.invoke({"input": user_input}, config=config)
+
+        output = self._compose(user_input, chat_history, plan, config=config)
+        self.memory.save_context({"input": user_input}, {"output": output})
+        return {"input": user_input, "output": output}
 
 
 class PCBuildAssistantApp:
@@ -1,74 +1,151 @@
-import json
-from langchain_google_genai import GoogleGenerativeAI
 from langchain_core.prompts import PromptTemplate
-from langchain.agents import Tool, initialize_agent, AgentType
-from langchain.memory import ConversationBufferMemory
+from langchain.agents import initialize_agent, AgentType
+from langchain.memory import ConversationSummaryBufferMemory
 from langchain_core.callbacks import BaseCallbackHandler
-from ddgs import DDGS
+from langchain_core.messages import get_buffer_string
+from ddgs.exceptions import DDGSException
 from dotenv import load_dotenv
-from datetime import datetime
-from time import sleep
+from datetime import date
+from time import sleep, monotonic, time_ns
+import os
+import sys
 import queue
 import threading
-from flask import Flask, Response, request, jsonify
-from flask_cors import CORS
+from quart import Quart, Response, request, jsonify
+from quart_cors import cors
+import numpy as np
+import faiss
+import atexit
+import asyncio
+import re
 import uuid
+import itertools
+import hashlib
+import zlib
+from collections import deque
+import pybreaker
+from cachetools import TTLCache
+import orjson
+
+from search_tools import CURRENT_YEAR, COMPOSER_TEMPLATE, DDGSearchTool, GeminiLLM, SearchPlanner
 
 load_dotenv()
 
 
-class DDGSearchTool:
-    """DuckDuckGo Search Tool wrapper for LangChain Tool interface."""
-    @staticmethod
-    def search(query: str) -> str:
-        sleep(4)  # Rate limiting
-        with DDGS(verify=True) as ddgs:
-            results = ddgs.text(query, max_results=5)
-            if not results:
-                return "No search results found."
-            final = []
-            for result in results:
-                final.append({
-                    "title": result['title'],
-                    "body": result['body'],
-                    "href": result['href']
-                })
-            with open('Results.json', 'w') as f:
-                json.dump(final, f, indent=4)
-            return '\n'.join(
-                f"Title: {result['title']}, Body:{result['body']}, (URL: {result['href']})"
-                for result in results[:5]
-            )
+class QuotaThrottle(BaseCallbackHandler):
+    """Holds back LLM calls that would push the rolling per-minute rate past the quota.
 
-    def to_langchain_tool(self) -> Tool:
-        return Tool.from_function(
-            name="Search",
-            func=self.search,
-            description=(
-                "Useful for finding current or detailed info about PC parts or compatibility. "
-                "Input should be a search query."
-            ),
-        )
+    Spacing calls proactively is cheaper than eating 429s and retrying them.
+    """
+
+    def __init__(self, max_per_minute: int, headroom: float = 0.9):
+        self.limit = max(1, int(max_per_minute * headroom))
+        self.calls = deque()
+        self.lock = threading.Lock()
+
+    def _expire(self, now: float):
+        while self.calls and now - self.calls[0] >= 60:
+            self.calls.popleft()
+
+    def calls_last_minute(self) -> int:
+        with self.lock:
+            self._expire(monotonic())
+            return len(self.calls)
+
+    def on_llm_start(self, serialized: dict, prompts: list, **kwargs):
+        while True:
+            with self.lock:
+                now = monotonic()
+                self._expire(now)
+                if len(self.calls) < self.limit:
+                    self.calls.append(now)
+                    return
+                wait = 60 - (now - self.calls[0])
+            sleep(wait)
+
+
+# Requests per minute allowed by the Gemini quota (free tier default)
+gemini_throttle = QuotaThrottle(max_per_minute=int(os.getenv("GEMINI_RPM", "15")))
+
+SEARCH_LOG_DIR = os.getenv(
+    "SEARCH_LOG_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "logs")
+)
+
+
+class SearchLog:
+    """Appends search results as NDJSON to a daily rolling file, off the request path.
+
+    A single writer thread does the file I/O. It is started by the first logged
+    search, so importing the module creates no thread and no log directory.
+    """
+
+    def __init__(self, log_dir: str = SEARCH_LOG_DIR):
+        self.log_dir = log_dir
+        self.queue = queue.Queue()
+        self._writer = None
+        self._lock = threading.Lock()
+
+    def put(self, entry: dict):
+        with self._lock:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write_entries, daemon=True)
+                self._writer.start()
+        self.queue.put(entry)
+
+    def _write_entries(self):
+        os.makedirs(self.log_dir, exist_ok=True)
+        while True:
+            entry = self.queue.get()
+            path = os.path.join(self.log_dir, f"search_results_{date.today().isoformat()}.ndjson")
+            try:
+                with open(path, 'ab') as f:
+                    f.write(orjson.dumps(entry) + b"\n")
+            except OSError as e:
+                print(f"Search log error: {e}")
+            finally:
+                self.queue.task_done()
+
+
+search_log = SearchLog()
 
 
 class AgentStreamingCallback(BaseCallbackHandler):
     """Enhanced callback handler to stream detailed agent steps via SSE."""
 
-    def __init__(self, q: queue.Queue):
+    # Tokens are coalesced into one event per window to avoid flooding the queue
+    TOKEN_FLUSH_INTERVAL = 0.05
+
+    def __init__(self, q: "EventBroadcast", loop: asyncio.AbstractEventLoop, session_id: str):
+        # Callbacks fire on the agent's worker thread, so events are handed to the loop
         self.q = q
-        self.session_id = str(uuid.uuid4())
+        self.loop = loop
+        self.session_id = session_id
+        # One random id per stream; events are numbered from it instead of each getting a uuid4
+        self.stream_id = uuid.uuid4().hex
+        self._counter = itertools.count()
+        self._token_buffer = []
+        self._last_token_flush = monotonic()
+
+    def next_event_id(self) -> str:
+        return f"{self.stream_id}-{next(self._counter)}"
 
     def _send_event(self, event_type: str, content: str, metadata: dict = None):
         """Send a properly formatted SSE event."""
         event_data = {
-            "id": str(uuid.uuid4()),
-            "timestamp": datetime.now().isoformat(),
+            "id": self.next_event_id(),
+            "timestamp_ns": time_ns(),  # Epoch nanoseconds, formatted by the client
             "session_id": self.session_id,
             "type": event_type,
             "content": content,
             "metadata": metadata or {}
         }
-        self.q.put(event_data)
+        self.loop.call_soon_threadsafe(self.q.put_nowait, event_data)
+
+    def _flush_tokens(self):
+        if self._token_buffer:
+            self._send_event("token", "".join(self._token_buffer))
+            self._token_buffer.clear()
+        self._last_token_flush = monotonic()
 
     def on_chain_start(self, serialized: dict, inputs: dict, **kwargs):
         self._send_event("chain_start", "🤖 PC Build Assistant is starting to analyze your request...")
@@ -87,7 +164,7 @@ class AgentStreamingCallback(BaseCallbackHandler):
         })
         
         # Send action being taken
-        tool_input_str = json.dumps(action.tool_input) if isinstance(action.tool_input, dict) else str(action.tool_input)
+        tool_input_str = orjson.dumps(action.tool_input).decode() if isinstance(action.tool_input, dict) else str(action.tool_input)
         self._send_event("action", f"🔧 Taking action: Using {action.tool} with input: {tool_input_str}")
 
     def on_tool_start(self, serialized: dict, input_str: str, **kwargs):
@@ -102,13 +179,20 @@ class AgentStreamingCallback(BaseCallbackHandler):
     def on_agent_finish(self, finish, **kwargs):
         self._send_event("agent_finish", "🎯 Analysis complete, preparing final recommendation...")
 
+    def on_llm_new_token(self, token: str, **kwargs):
+        self._token_buffer.append(token)
+        if monotonic() - self._last_token_flush >= self.TOKEN_FLUSH_INTERVAL:
+            self._flush_tokens()
+
     def on_llm_end(self, response, **kwargs):
+        self._flush_tokens()
         self._send_event("llm_end", "✨ Processing complete")
 
     def on_chain_end(self, outputs: dict, **kwargs):
         self._send_event("chain_end", "🏁 PC build recommendation ready!")
 
     def on_llm_error(self, error, **kwargs):
+        self._flush_tokens()
         self._send_event("error", f"❌ Error in language model: {str(error)}")
 
     def on_tool_error(self, error, **kwargs):
@@ -118,69 +202,382 @@ class AgentStreamingCallback(BaseCallbackHandler):
         self._send_event("error", f"❌ Agent error: {str(error)}")
 
 
-class PCBuildAgent:
+SYSTEM_PROMPT_TEXT = (
+    "You are an expert PC build assistant and hardware specialist.\n"
+    "Current year: {year}\n\n"
+    "Your mission:\n"
+    "- Help users build custom PCs within their budget\n"
+    "- Focus on best value-for-money components\n"
+    "- Always search in English\n"
+    "- Use search tool strategically - only when you need current pricing or specific component details\n"
+    "- Prefer BatchSearch with all components you still need info on, in a single call\n\n"
+    "For each recommendation, provide:\n"
+    "1. Component name and model\n"
+    "2. Estimated price\n"
+    "3. Why this component (performance/value reasoning)\n"
+    "4. Compatibility notes\n\n"
+    "Think step by step and explain your reasoning clearly.\n"
+    "End with a complete build summary including total estimated cost.\n"
+)
+
+# Rendered once per process; only the per-call slots are filled in later
+_SYSTEM_TEMPLATE = PromptTemplate.from_template(SYSTEM_PROMPT_TEXT)
+_RENDERED_PREFIX = sys.intern(_SYSTEM_TEMPLATE.format(year=CURRENT_YEAR))
+
+COMPOSER_PROMPT = COMPOSER_TEMPLATE.partial(system_prompt=_RENDERED_PREFIX)
+
+
+class PCBuildAgent(SearchPlanner):
     """Encapsulates the LLM and agent logic for PC building assistance."""
 
+    composer_prompt = COMPOSER_PROMPT
+
     def __init__(self):
-        self.llm = GoogleGenerativeAI(
+        self.llm = GeminiLLM(
             model="gemini-2.5-flash-lite", 
             temperature=0.7,  # Slightly reduced for more consistent responses
+            request_timeout=20,  # Cancel hung calls instead of blocking the worker
+            max_retries=3,  # Initial call plus two retries
+            callbacks=[gemini_throttle],
             verbose=True
         )
-        self.tools = [DDGSearchTool().to_langchain_tool()]
-        self.memory = ConversationBufferMemory(
-            memory_key="chat_history", 
+        search_tool = DDGSearchTool(on_results=search_log.put)
+        self.batch_tool = search_tool.to_langchain_batch_tool()
+        self.tools = [search_tool.to_langchain_tool(), self.batch_tool]
+        self.agent = self._initialize_agent()
+
+    def create_memory(self) -> ConversationSummaryBufferMemory:
+        """Create chat memory for one conversation; the LLM and tools are shared."""
+        return ConversationSummaryBufferMemory(
+            llm=self.llm,
+            memory_key="chat_history",
             return_messages=True,
-            max_token_limit=2000  # Prevent memory from growing too large
-        )
-        self.system_prompt = (
-            "You are an expert PC build assistant and hardware specialist.\n"
-            f"Current year: {datetime.now().year}\n\n"
-            "Your mission:\n"
-            "- Help users build custom PCs within their budget\n"
-            "- Focus on best value-for-money components\n"
-            "- Always search in English\n"
-            "- Use search tool strategically - only when you need current pricing or specific component details\n\n"
-            "For each recommendation, provide:\n"
-            "1. Component name and model\n"
-            "2. Estimated price\n"
-            "3. Why this component (performance/value reasoning)\n"
-            "4. Compatibility notes\n\n"
-            "Think step by step and explain your reasoning clearly.\n"
-            "End with a complete build summary including total estimated cost.\n"
+            max_token_limit=1500  # Older turns are summarized past this limit
         )
-        self.agent = self._initialize_agent()
 
     def _initialize_agent(self):
         return initialize_agent(
             tools=self.tools,
             llm=self.llm,
-            agent_type=AgentType.ZERO_SHOT_REACT_DESCRIPTION,
+            agent=AgentType.ZERO_SHOT_REACT_DESCRIPTION,
             verbose=True,
             handle_parsing_errors=True,
-            max_iterations=15,  # Reduced to prevent excessive searches
-            memory=self.memory,
-            agent_kwargs={
-                "system_message": self.system_prompt,
-                "prefix": "You are a PC build expert. Think carefully about each component choice."
-            }
+            max_iterations=5,  # Only a fallback when planning fails
+            # ZERO_SHOT_REACT ignores system_message, the prefix is what reaches the model
+            agent_kwargs={"prefix": _RENDERED_PREFIX}
         )
 
+    def invoke(self, user_input: str, memory: ConversationSummaryBufferMemory, callbacks: list = None) -> dict:
+        """Answer in at most three LLM calls: plan searches, run them as one batch, compose.
+
+        Falls back to the ReAct agent if the plan cannot be parsed. Only answers
+        from the planned path are marked `cacheable`; the fallback can stop at its
+        iteration limit with a placeholder instead of an answer. `memory` is only
+        read; the caller records the exchange once the answer has been sent.
+        """
+        config = {"callbacks": callbacks}
+        chat_history = get_buffer_string(memory.load_memory_variables({})["chat_history"])
+        try:
+            plan = self._plan(user_input, chat_history, config=config)
+        except ValueError as e:
+            print(f"Planner failed, falling back to agent: {e}")
+            return self.agent.invoke({"input": user_input}, config=config)
+
+        output = self._compose(user_input, chat_history, plan, config=config)
+        return {"input": user_input, "output": output, "cacheable": True}
+
+
+EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+# INT8 model produced once with:
+#   optimum-cli export onnx --model sentence-transformers/all-MiniLM-L6-v2 --task feature-extraction onnx_model/
+#   optimum-cli onnxruntime quantize --avx512_vnni --onnx_model onnx_model/ -o onnx_int8/
+#   cp onnx_model/tokenizer*.json onnx_model/special_tokens_map.json onnx_model/vocab.txt onnx_int8/
+ONNX_EMBEDDER_DIR = os.getenv("ONNX_EMBEDDER_DIR", "onnx_int8")
+
+
+class OnnxEmbedder:
+    """INT8-quantized ONNX Runtime version of all-MiniLM-L6-v2.
+
+    Exposes the same `encode` call as SentenceTransformer, including its mean
+    pooling, so the two are interchangeable for the semantic cache.
+    """
+
+    def __init__(self, model_dir: str = ONNX_EMBEDDER_DIR):
+        # Imported here so optimum/onnxruntime are only needed when the INT8 model is present
+        from optimum.onnxruntime import ORTModelForFeatureExtraction
+        from transformers import AutoTokenizer
+
+        # Load from the export directory so an offline setup never reaches the Hub
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.model = ORTModelForFeatureExtraction.from_pretrained(
+            model_dir, file_name="model_quantized.onnx", provider="CPUExecutionProvider"
+        )
+
+    def encode(self, texts: list[str], normalize_embeddings: bool = False) -> np.ndarray:
+        inputs = self.tokenizer(texts, padding=True, truncation=True, return_tensors="np")
+        token_embeddings = self.model(**inputs).last_hidden_state
+        mask = inputs["attention_mask"][..., None].astype(np.float32)
+        embeddings = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        if normalize_embeddings:
+            embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+        return embeddings.astype(np.float32)
+
+
+def _create_embedder():
+    if os.path.isdir(ONNX_EMBEDDER_DIR):
+        return OnnxEmbedder()
+    print(f"No quantized model in {ONNX_EMBEDDER_DIR}, using the PyTorch embedder")
+    # Imported here so torch is only loaded when the INT8 model is missing
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(EMBEDDING_MODEL)
+
+
+# Anchored to this file so the cache lands in backend/cache whatever the working directory
+SEMANTIC_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache")
+# Budgets, capacities and model numbers barely move the embedding but change the answer
+PROMPT_NUMBER_PATTERN = re.compile(r"\d[\d,]*(?:\.\d+)?")
+
+
+def prompt_numbers(prompt: str) -> list[str]:
+    """The numbers in `prompt`, sorted and without separators so "50,000" equals "50000"."""
+    return sorted(number.replace(",", "") for number in PROMPT_NUMBER_PATTERN.findall(prompt))
+
+
+class SemanticCache:
+    """Caches final answers keyed on prompt embeddings.
+
+    Prompts whose normalized embedding has cosine similarity above `threshold`
+    with a cached prompt, and which contain the same numbers, reuse its answer
+    instead of re-running the agent.
+    Brute-force search is used until the cache reaches REBUILD_EVERY entries,
+    after which the index is rebuilt as HNSW in the background and rebuilt
+    again every REBUILD_EVERY additions.
+    """
+
+    REBUILD_EVERY = 10000
+    # Near neighbours checked per lookup, since the closest one may be for a different budget
+    LOOKUP_NEIGHBOURS = 4
+
+    def __init__(self, cache_dir: str = SEMANTIC_CACHE_DIR, threshold: float = 0.92, dim: int = 384):
+        self._embedder = None
+        self._embedder_lock = threading.Lock()
+        self.threshold = threshold
+        self.dim = dim
+        self.index_path = os.path.join(cache_dir, "semantic.index")
+        self.entries_path = os.path.join(cache_dir, "semantic_entries.json")
+        self.cache_index = faiss.IndexFlatIP(dim)
+        # Parallel to the index: {"response": answer, "numbers": prompt_numbers(prompt)}
+        self.cache_entries: list[dict] = []
+        self.lock = threading.Lock()
+        self._added_since_rebuild = 0
+        self._rebuilding = False
+        self._load()
+
+    @property
+    def embedder(self):
+        # Loaded on first use so app startup does not wait on the model download/load
+        with self._embedder_lock:
+            if self._embedder is None:
+                self._embedder = _create_embedder()
+            return self._embedder
+
+    def embed(self, prompt: str):
+        return self.embedder.encode([prompt], normalize_embeddings=True)
+
+    def lookup(self, embedding, prompt: str):
+        """Return the closest cached answer for a prompt with the same numbers, or None on a miss."""
+        numbers = prompt_numbers(prompt)
+        with self.lock:
+            if self.cache_index.ntotal == 0:
+                return None
+            D, I = self.cache_index.search(embedding, min(self.LOOKUP_NEIGHBOURS, self.cache_index.ntotal))
+            for score, i in zip(D[0], I[0]):
+                if i < 0 or score <= self.threshold:
+                    break
+                if self.cache_entries[i]["numbers"] == numbers:
+                    return self.cache_entries[i]["response"]
+        return None
+
+    def add(self, embedding, prompt: str, response: str):
+        with self.lock:
+            self.cache_index.add(embedding)
+            self.cache_entries.append({"response": response, "numbers": prompt_numbers(prompt)})
+            self._added_since_rebuild += 1
+            is_flat = not hasattr(self.cache_index, "hnsw")
+            needs_rebuild = self._added_since_rebuild >= self.REBUILD_EVERY or (
+                is_flat and self.cache_index.ntotal >= self.REBUILD_EVERY
+            )
+            if needs_rebuild and not self._rebuilding:
+                self._rebuilding = True
+                threading.Thread(target=self._rebuild, daemon=True).start()
+
+    def _new_hnsw_index(self):
+        # Inner product metric so scores stay cosine similarities like IndexFlatIP
+        index = faiss.IndexHNSWFlat(self.dim, 32, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = 64
+        index.hnsw.efSearch = 32
+        return index
+
+    def _rebuild(self):
+        """Build a fresh HNSW index off the request path and swap it in."""
+        try:
+            with self.lock:
+                count = self.cache_index.ntotal
+                vectors = self.cache_index.reconstruct_n(0, count)
+            index = self._new_hnsw_index()
+            index.add(vectors)
+            with self.lock:
+                # Pick up anything added while the new index was being built
+                if self.cache_index.ntotal > count:
+                    index.add(self.cache_index.reconstruct_n(count, self.cache_index.ntotal - count))
+                self.cache_index = index
+                self._added_since_rebuild = 0
+        except Exception as e:
+            print(f"Semantic cache rebuild failed: {e}")
+        finally:
+            self._rebuilding = False
+
+    def save(self):
+        """Persist the index and answers so the cache survives restarts."""
+        with self.lock:
+            os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+            faiss.write_index(self.cache_index, self.index_path)
+            with open(self.entries_path, 'wb') as f:
+                f.write(orjson.dumps(self.cache_entries))
+
+    def _load(self):
+        if not (os.path.exists(self.index_path) and os.path.exists(self.entries_path)):
+            return
+        try:
+            index = faiss.read_index(self.index_path)
+            with open(self.entries_path, 'rb') as f:
+                entries = orjson.loads(f.read())
+        except Exception as e:
+            print(f"Could not load semantic cache: {e}")
+            return
+        if index.ntotal == len(entries):
+            if hasattr(index, "hnsw"):
+                index.hnsw.efSearch = 32
+            self.cache_index = index
+            self.cache_entries = entries
+
+
+class EventBroadcast:
+    """Fans one agent run's events out to every client streaming it.
+
+    Only touched from the event loop thread, so no locking is needed. Each
+    subscriber sees its own session_id on the events it receives.
+    """
+
+    def __init__(self):
+        self.subscribers: list[tuple[asyncio.Queue, str, ConversationSummaryBufferMemory]] = []
+
+    def subscribe(self, session_id: str, memory: ConversationSummaryBufferMemory) -> asyncio.Queue:
+        q = asyncio.Queue()
+        self.subscribers.append((q, session_id, memory))
+        return q
+
+    def put_nowait(self, event):
+        for q, session_id, _ in self.subscribers:
+            if event is None or event.get("session_id") == session_id:
+                q.put_nowait(event)
+            else:
+                q.put_nowait({**event, "session_id": session_id})
+
+    def memories(self) -> list:
+        """Snapshot the distinct chat memories of every attached conversation."""
+        memories = []
+        seen = set()
+        for _, _, memory in self.subscribers:
+            if id(memory) not in seen:
+                seen.add(id(memory))
+                memories.append(memory)
+        return memories
+
+
+def save_shared_answer(memories: list, user_input: str, output: str):
+    """Record an answer from a shared run in each attached conversation."""
+    for memory in memories:
+        memory.save_context({"input": user_input}, {"output": output})
+
+
+# Fastest level: event payloads are small and repetitive, bandwidth matters more than CPU here
+SSE_COMPRESS_LEVEL = 1
+
+
+async def gzip_sse_stream(events):
+    """Gzip a stream of SSE frames, flushing after each frame so events are not held back."""
+    compressor = zlib.compressobj(SSE_COMPRESS_LEVEL, zlib.DEFLATED, 31)  # wbits=31 -> gzip container
+    async for frame in events:
+        yield compressor.compress(frame.encode()) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
+
 
 class PCBuildAssistantApp:
-    """Main Flask application with proper SSE implementation."""
+    """Main Quart application with proper SSE implementation.
+
+    Each SSE client is a coroutine waiting on an asyncio.Queue rather than a
+    blocked worker thread; only the agent run itself is offloaded to a thread.
+    """
 
     def __init__(self):
         self.agent = PCBuildAgent()
-        self.flask_app = Flask(__name__)
-        CORS(self.flask_app, supports_credentials=True)
+        self.cache = SemanticCache()
+        atexit.register(self.cache.save)
+        self.agent_tasks = set()
+        # Chat memory per conversation, dropped after 30 idle minutes
+        self.sessions = TTLCache(maxsize=10000, ttl=1800)
+        # Agent runs in progress keyed by prompt hash, so identical prompts share one run
+        self.inflight: dict[str, EventBroadcast] = {}
+        # Stop calling Gemini for a while after repeated failures instead of hanging every request.
+        # Search failures (no results, DDG rate limits) say nothing about Gemini's health.
+        self.breaker = pybreaker.CircuitBreaker(fail_max=5, reset_timeout=30, exclude=[DDGSException])
+        # A pattern origin lets quart-cors echo the caller's origin with credentials allowed
+        self.quart_app = cors(Quart(__name__), allow_origin=re.compile(r".*"), allow_credentials=True)
         self._setup_routes()
+        # Requests are accepted while warming up; the first one just may be slower
+        self.ready = threading.Event()
+        threading.Thread(target=self._warmup, daemon=True).start()
+
+    def _join_inflight(self, key, session_id: str, memory):
+        """Attach to an identical run already in progress; returns its event queue or None."""
+        if key is None or key not in self.inflight:
+            return None
+        return self.inflight[key].subscribe(session_id, memory)
+
+    def _save_in_background(self, save, *args):
+        """Run a chat memory save on a worker thread without holding up the stream.
+
+        Saving can call Gemini (token counts, summaries), so it runs after the answer is sent.
+        """
+        async def run():
+            try:
+                await asyncio.to_thread(save, *args)
+            except Exception as e:
+                print(f"Memory save error: {e}")
+
+        # Keep a reference so the task is not garbage collected mid-run
+        task = asyncio.create_task(run())
+        self.agent_tasks.add(task)
+        task.add_done_callback(self.agent_tasks.discard)
+
+    def _warmup(self):
+        """Load the embedding model and open the Gemini connection before the first request."""
+        try:
+            self.cache.embed("warmup")
+            self.agent.llm.invoke("say hi")
+        except Exception as e:
+            print(f"Warmup error: {e}")
+        finally:
+            self.ready.set()
 
     def _setup_routes(self):
-        @self.flask_app.route('/', methods=['GET'])
-        def health_check():
+        @self.quart_app.route('/', methods=['GET'])
+        async def health_check():
             return jsonify({
-                "status": "healthy",
+                "status": "healthy" if self.ready.is_set() else "warming_up",
+                "llm_circuit": self.breaker.current_state,
+                "llm_calls_last_minute": gemini_throttle.calls_last_minute(),
                 "service": "PC Build Assistant",
                 "endpoints": {
                     "stream": "/stream (POST)",
@@ -188,15 +585,15 @@ class PCBuildAssistantApp:
                 }
             })
 
-        @self.flask_app.route('/stream', methods=['POST'])
-        def stream_response():
+        @self.quart_app.route('/stream', methods=['POST'])
+        async def stream_response():
             """Stream agent responses using Server-Sent Events."""
             
             # Validate request
             if not request.is_json:
                 return jsonify({"error": "Content-Type must be application/json"}), 415
 
-            data = request.get_json()
+            data = await request.get_json()
             if not data or 'prompt' not in data:
                 return jsonify({"error": "Missing 'prompt' in request body"}), 400
 
@@ -204,112 +601,194 @@ class PCBuildAssistantApp:
             if not prompt:
                 return jsonify({"error": "Prompt cannot be empty"}), 400
 
-            # Create queue for streaming events
-            event_queue = queue.Queue()
-            
-            def run_agent():
-                """Run the agent in a separate thread."""
-                callback_handler = AgentStreamingCallback(event_queue)
-                
-                try:
-                    # Send initial event
-                    event_queue.put({
-                        "id": str(uuid.uuid4()),
-                        "timestamp": datetime.now().isoformat(),
-                        "type": "start",
-                        "content": f"🚀 Starting PC build analysis for: {prompt[:100]}..."
-                    })
-                    
-                    # Run the agent
-                    response = self.agent.agent.invoke(
-                        {"input": prompt},
-                        callbacks=[callback_handler]
-                    )
-                    
-                    # Send final response
-                    event_queue.put({
-                        "id": str(uuid.uuid4()),
-                        "timestamp": datetime.now().isoformat(),
-                        "type": "final_answer",
-                        "content": response.get('output', 'No response generated'),
-                        "metadata": {
-                            "total_tokens": getattr(response, 'total_tokens', None),
-                            "processing_time": "completed"
-                        }
-                    })
-                    
-                except Exception as e:
-                    print(f"Agent error: {e}")  # Log for debugging
-                    event_queue.put({
-                        "id": str(uuid.uuid4()),
-                        "timestamp": datetime.now().isoformat(),
-                        "type": "error",
-                        "content": f"An error occurred: {str(e)}",
-                        "metadata": {"error_type": type(e).__name__}
-                    })
-                finally:
-                    # Signal end of stream
-                    event_queue.put(None)
-
-            # Start agent in background thread
-            agent_thread = threading.Thread(target=run_agent, daemon=True)
-            agent_thread.start()
-
-            def generate_sse_events():
+            # Returning users send back the session_id from a previous stream to keep context
+            session_id = str(data.get('session_id') or uuid.uuid4().hex)
+            memory = self.sessions.get(session_id)
+            if memory is None:
+                memory = self.agent.create_memory()
+            self.sessions[session_id] = memory  # Refresh the idle TTL
+
+            # Only fresh conversations can share a run; with history the answer depends on it
+            has_history = bool(memory.chat_memory.messages or memory.moving_summary_buffer)
+            inflight_key = None if has_history else hashlib.blake2b(prompt.encode(), digest_size=16).hexdigest()
+
+            event_queue = self._join_inflight(inflight_key, session_id, memory)
+            # The semantic cache is shared by all users, so it only serves and stores
+            # answers that do not depend on a conversation's history
+            prompt_embedding = None
+            cached_output = None
+            if event_queue is None and not has_history:
+                prompt_embedding = await asyncio.to_thread(self.cache.embed, prompt)
+                cached_output = self.cache.lookup(prompt_embedding, prompt)
+                # An identical run may have started while the prompt was being embedded
+                event_queue = self._join_inflight(inflight_key, session_id, memory)
+
+            if event_queue is None and cached_output is not None:
+                # Similar prompt already answered, skip the agent entirely
+                event_queue = asyncio.Queue()
+                event_queue.put_nowait({
+                    "id": f"{uuid.uuid4().hex}-0",
+                    "timestamp_ns": time_ns(),
+                    "session_id": session_id,
+                    "type": "final_answer",
+                    "content": cached_output,
+                    "metadata": {"cached": True}
+                })
+                event_queue.put_nowait(None)
+                self._save_in_background(memory.save_context, {"input": prompt}, {"output": cached_output})
+            elif event_queue is None:
+                broadcast = EventBroadcast()
+                event_queue = broadcast.subscribe(session_id, memory)
+                if inflight_key is not None:
+                    self.inflight[inflight_key] = broadcast
+
+                async def run_agent():
+                    """Run the agent on a worker thread and stream its events."""
+                    callback_handler = AgentStreamingCallback(broadcast, asyncio.get_running_loop(), session_id)
+
+                    try:
+                        # Send initial event
+                        broadcast.put_nowait({
+                            "id": callback_handler.next_event_id(),
+                            "timestamp_ns": time_ns(),
+                            "session_id": session_id,
+                            "type": "start",
+                            "content": f"🚀 Starting PC build analysis for: {prompt[:100]}..."
+                        })
+
+                        # Run the agent
+                        response = await asyncio.to_thread(
+                            self.breaker.call,
+                            self.agent.invoke,
+                            prompt,
+                            memory,
+                            callbacks=[callback_handler]
+                        )
+
+                        # Close the run to new subscribers so the memory snapshot below is complete
+                        if inflight_key is not None:
+                            self.inflight.pop(inflight_key, None)
+
+                        output = response.get('output')
+                        if output and prompt_embedding is not None and response.get('cacheable'):
+                            self.cache.add(prompt_embedding, prompt, output)
+
+                        # Tokens were already streamed, this marks the answer as complete
+                        broadcast.put_nowait({
+                            "id": callback_handler.next_event_id(),
+                            "timestamp_ns": time_ns(),
+                            "session_id": session_id,
+                            "type": "final_answer",
+                            "content": response.get('output', 'No response generated'),
+                            "metadata": {
+                                "total_tokens": getattr(response, 'total_tokens', None),
+                                "processing_time": "completed"
+                            }
+                        })
+                        if output:
+                            # Every attached conversation records the answer once it has been sent
+                            self._save_in_background(save_shared_answer, broadcast.memories(), prompt, output)
+
+                    except pybreaker.CircuitBreakerError:
+                        broadcast.put_nowait({
+                            "id": callback_handler.next_event_id(),
+                            "timestamp_ns": time_ns(),
+                            "session_id": session_id,
+                            "type": "error",
+                            "content": "The AI service is temporarily unavailable. Please try again in a minute.",
+                            "metadata": {"error_type": "CircuitBreakerError"}
+                        })
+                    except Exception as e:
+                        print(f"Agent error: {e}")  # Log for debugging
+                        broadcast.put_nowait({
+                            "id": callback_handler.next_event_id(),
+                            "timestamp_ns": time_ns(),
+                            "session_id": session_id,
+                            "type": "error",
+                            "content": f"An error occurred: {str(e)}",
+                            "metadata": {"error_type": type(e).__name__}
+                        })
+                    finally:
+                        if inflight_key is not None:
+                            self.inflight.pop(inflight_key, None)
+                        # Signal end of stream
+                        broadcast.put_nowait(None)
+
+                # Keep a reference so the task is not garbage collected mid-run
+                agent_task = asyncio.create_task(run_agent())
+                self.agent_tasks.add(agent_task)
+                agent_task.add_done_callback(self.agent_tasks.discard)
+
+            async def generate_sse_events():
                 """Generate Server-Sent Events from the queue."""
                 try:
                     while True:
                         try:
                             # Get event from queue with timeout
-                            event = event_queue.get(timeout=60)  # 60 second timeout
+                            event = await asyncio.wait_for(event_queue.get(), timeout=15)
                             
                             if event is None:
                                 # End of stream signal
-                                yield f"event: end\ndata: {json.dumps({'type': 'stream_end', 'content': 'Stream completed'})}\n\n"
+                                yield f"event: end\ndata: {orjson.dumps({'type': 'stream_end', 'content': 'Stream completed'}).decode()}\n\n"
                                 break
                             
                             # Format as proper SSE
                             event_type = event.get('type', 'message')
-                            event_data = json.dumps(event, ensure_ascii=False)
+                            event_data = orjson.dumps(event).decode()
                             
                             yield f"event: {event_type}\ndata: {event_data}\n\n"
                             
-                        except queue.Empty:
+                        except asyncio.TimeoutError:
                             # Send keepalive ping
-                            yield f"event: ping\ndata: {json.dumps({'type': 'ping', 'timestamp': datetime.now().isoformat()})}\n\n"
+                            yield f"event: ping\ndata: {orjson.dumps({'type': 'ping', 'timestamp_ns': time_ns()}).decode()}\n\n"
                             continue
                             
-                except GeneratorExit:
+                except asyncio.CancelledError:
                     print("Client disconnected from SSE stream")
+                    raise
                 except Exception as e:
                     print(f"SSE streaming error: {e}")
-                    yield f"event: error\ndata: {json.dumps({'type': 'stream_error', 'content': str(e)})}\n\n"
+                    yield f"event: error\ndata: {orjson.dumps({'type': 'stream_error', 'content': str(e)}).decode()}\n\n"
+
+            headers = {
+                'Cache-Control': 'no-cache',
+                'Connection': 'keep-alive',
+                'X-Accel-Buffering': 'no',  # Disable nginx buffering
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
+                'Access-Control-Allow-Headers': 'Content-Type',
+                'Vary': 'Accept-Encoding'
+            }
+            body = generate_sse_events()
+            if request.accept_encodings["gzip"]:
+                body = gzip_sse_stream(body)
+                headers['Content-Encoding'] = 'gzip'
 
             # Return SSE response with proper headers
-            response = Response(
-                generate_sse_events(),
-                mimetype='text/event-stream',
-                headers={
-                    'Cache-Control': 'no-cache',
-                    'Connection': 'keep-alive',
-                    'X-Accel-Buffering': 'no',  # Disable nginx buffering
-                    'Access-Control-Allow-Origin': '*',
-                    'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                    'Access-Control-Allow-Headers': 'Content-Type'
-                }
-            )
+            response = Response(body, mimetype='text/event-stream', headers=headers)
+            # Agent runs can outlast Quart's default 60s response timeout
+            response.timeout = None
             return response
 
-        @self.flask_app.route('/stream', methods=['OPTIONS'])
-        def stream_options():
+        @self.quart_app.route('/stream', methods=['OPTIONS'])
+        async def stream_options():
             """Handle CORS preflight requests."""
             return jsonify({}), 200
 
     def run_server(self, host='0.0.0.0', port=5000, debug=False):
-        """Start the Flask development server."""
+        """Start the Quart development server.
+
+        For production serve with hypercorn instead:
+        hypercorn "main:create_app()" --workers 1 --worker-class asyncio
+        """
         print(f"🚀 PC Build Assistant starting on http://{host}:{port}")
         print(f"📡 SSE endpoint available at http://{host}:{port}/stream")
-        self.flask_app.run(host=host, port=port, debug=debug, threaded=True)
+        self.quart_app.run(host=host, port=port, debug=debug)
+
+
+def create_app() -> Quart:
+    """ASGI app factory for hypercorn."""
+    return PCBuildAssistantApp().quart_app
 
 
 if __name__ == "__main__":
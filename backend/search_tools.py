@@ -0,0 +1,288 @@
+"""Search, parts catalog and search planning shared by the web server and the CLI."""
+import orjson
+from langchain_google_genai import GoogleGenerativeAI
+from langchain.agents import Tool
+from langchain_core.prompts import PromptTemplate
+from pydantic import BaseModel, TypeAdapter
+
+from ddgs import DDGS
+from rapidfuzz import fuzz, process, utils
+from dotenv import load_dotenv
+from datetime import datetime
+from time import sleep, monotonic
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+load_dotenv()
+
+# Only the year goes into the prompts, so read the clock once at import
+CURRENT_YEAR = datetime.now().year
+
+
+class RateLimiter:
+    """Spaces calls at least `min_interval` seconds apart.
+
+    Callers only sleep for the time remaining since the last granted slot, so
+    searches already spread out by LLM latency are not delayed at all. When a
+    Redis client is given the slot is shared by every worker process.
+    """
+
+    def __init__(self, min_interval: float, redis_client=None, key: str = "ratelimit:ddgs"):
+        self.min_interval = min_interval
+        self.next_ok = 0.0
+        self.lock = threading.Lock()
+        self.redis = redis_client
+        self.key = key
+
+    def wait(self):
+        if self.redis is not None:
+            self._wait_shared()
+            return
+        with self.lock:
+            now = monotonic()
+            wait = max(0.0, self.next_ok - now)
+            # Reserve the slot before sleeping so concurrent callers queue up behind it
+            self.next_ok = max(now, self.next_ok) + self.min_interval
+        if wait:
+            sleep(wait)
+
+    def _wait_shared(self):
+        # The key exists for exactly min_interval after each granted call, so whoever
+        # manages to create it is at least min_interval behind the previous caller
+        interval_ms = max(1, int(self.min_interval * 1000))
+        while True:
+            if self.redis.set(self.key, 1, nx=True, px=interval_ms):
+                return
+            # -2 means the key expired in the meantime; retry right away
+            sleep(max(self.redis.pttl(self.key), 1) / 1000)
+
+
+def _create_search_limiter() -> RateLimiter:
+    redis_url = os.getenv("REDIS_URL")
+    if not redis_url:
+        return RateLimiter(min_interval=2.0)
+    import redis
+    return RateLimiter(min_interval=2.0, redis_client=redis.Redis.from_url(redis_url))
+
+
+search_limiter = _create_search_limiter()
+
+
+# Larger batches give diminishing returns against the shared search rate limit
+MAX_BATCH_QUERIES = 8
+# Search output is fed back into every later prompt, so keep it short
+MAX_SEARCH_RESULTS = 3
+MAX_RESULT_BODY_CHARS = 160
+
+
+# One client for the whole process so the engines' HTTP connections are kept alive
+# and reused instead of paying a fresh TCP/TLS handshake on every search
+shared_ddgs = DDGS(verify=True)
+
+
+# Static price catalog consulted before searching; refreshed out of band, not per request
+CATALOG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "parts_india_2024.json")
+CATALOG_MATCH_THRESHOLD = 85
+# Words that say nothing about which part is wanted; dropped before matching so only the
+# substance of the query has to line up with a catalog key
+CATALOG_FILLER_WORDS = frozenset({
+    "best", "top", "good", "recommended", "price", "prices", "pricing", "cost", "buy",
+    "india", "indian", "inr", "rs", "rupees", "under", "below", "within", "around",
+    "for", "in", "the", "a", "an", "of", "with", "to",
+})
+
+
+class PartsCatalog:
+    """Answers common component/tier queries from the bundled catalog without a web search."""
+
+    def __init__(self, path: str = CATALOG_PATH):
+        try:
+            with open(path, 'rb') as f:
+                data = orjson.loads(f.read())
+        except (OSError, orjson.JSONDecodeError) as e:
+            print(f"Could not load parts catalog: {e}")
+            data = {}
+        self.updated = data.get("updated", "unknown")
+        self.entries: dict = data.get("entries", {})
+        self.keys = list(self.entries)
+
+    @staticmethod
+    def _normalize(query: str) -> str:
+        words = utils.default_process(query).split()
+        return " ".join(w for w in words if w not in CATALOG_FILLER_WORDS and not w.isdigit())
+
+    def lookup(self, query: str):
+        """Return formatted catalog entries for `query`, or None if nothing matches confidently."""
+        query = self._normalize(query)
+        if not self.keys or not query:
+            return None
+        # token_sort_ratio penalizes leftover query words, so "budget cpu cooler" does not match "budget cpu"
+        match = process.extractOne(
+            query, self.keys, scorer=fuzz.token_sort_ratio, processor=utils.default_process
+        )
+        if match is None or match[1] <= CATALOG_MATCH_THRESHOLD:
+            return None
+        return '\n'.join(
+            f"Title: {part['name']}, Body:Approx. ₹{part['price_min']:,}-₹{part['price_max']:,} "
+            f"in India as of {self.updated}. {part['notes']}, (Source: local parts catalog)"
+            for part in self.entries[match[0]]
+        )
+
+
+parts_catalog = PartsCatalog()
+
+
+class DDGSearchTool:
+    """DuckDuckGo Search Tool wrapper for LangChain Tool interface.
+
+    `on_results` is called with each web search's raw results, e.g. to log them.
+    """
+
+    def __init__(self, on_results=None):
+        self.on_results = on_results
+
+    def search(self, query: str) -> str:
+        catalog_result = parts_catalog.lookup(query)
+        if catalog_result is not None:
+            return catalog_result
+
+        search_limiter.wait()  # Rate limiting
+        results = shared_ddgs.text(query, max_results=MAX_SEARCH_RESULTS)
+        if not results:
+            return "No search results found."
+        if self.on_results is not None:
+            self.on_results({
+                "query": query,
+                "results": [
+                    {"title": result['title'], "body": result['body'], "href": result['href']}
+                    for result in results
+                ],
+            })
+        return '\n'.join(
+            f"Title: {result['title']}, Body:{result['body'][:MAX_RESULT_BODY_CHARS]}, (URL: {result['href']})"
+            for result in results[:MAX_SEARCH_RESULTS]
+        )
+
+    def batch_search(self, queries: str) -> str:
+        """Run several searches concurrently and label each result block with its query."""
+        try:
+            parsed = orjson.loads(queries)
+        except orjson.JSONDecodeError:
+            parsed = queries
+        if not isinstance(parsed, list):
+            parsed = [parsed]
+        query_list = [str(q).strip() for q in parsed if str(q).strip()][:MAX_BATCH_QUERIES]
+        if not query_list:
+            return "No search queries provided."
+
+        def search_one(query: str) -> str:
+            # One failed query must not sink the rest of the batch
+            try:
+                return self.search(query)
+            except Exception as e:
+                print(f"Search error for '{query}': {e}")
+                return "No search results found."
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            results = executor.map(search_one, query_list)
+            return '\n\n'.join(
+                f"Results for '{query}':\n{result}"
+                for query, result in zip(query_list, results)
+            )
+
+    def to_langchain_tool(self) -> Tool:
+        return Tool.from_function(
+            name="Search",
+            func=self.search,
+            description=(
+                "Useful for finding current or detailed info about PC parts or compatibility. "
+                "Input should be a search query."
+            ),
+        )
+
+    def to_langchain_batch_tool(self) -> Tool:
+        return Tool.from_function(
+            name="BatchSearch",
+            func=self.batch_search,
+            description=(
+                "Useful for looking up several PC parts at once. "
+                f"Input should be a JSON list of up to {MAX_BATCH_QUERIES} search queries; "
+                "returns concatenated results labeled by query."
+            ),
+        )
+
+
+class GeminiLLM(GoogleGenerativeAI):
+    """GoogleGenerativeAI that estimates token counts locally.
+
+    Chat memory counts tokens on every save and recounts its buffer while
+    pruning; the stock count_tokens RPC made each of those a Gemini round-trip.
+    """
+
+    def get_num_tokens(self, text: str) -> int:
+        # About four characters per token, close enough to decide when to summarize
+        return (len(text) + 3) // 4
+
+
+class SearchStep(BaseModel):
+    """One web search the planner wants run for a build component."""
+    component: str
+    query: str
+
+
+search_plan_adapter = TypeAdapter(list[SearchStep])
+
+# The planner only has to emit JSON, so it gets none of the system prompt's answer-format rules
+PLANNER_PROMPT = PromptTemplate.from_template(
+    "You plan the web searches for a PC build assistant. The current year is {year}. "
+    "Write every search query in English.\n\n"
+    "Conversation so far:\n{chat_history}\n\n"
+    "User request: {input}\n\n"
+    "Plan the web searches needed to choose current components for this request. "
+    "Reply with only a JSON list of at most {max_queries} objects such as "
+    '[{{"component": "CPU", "query": "best CPU under 10000 INR"}}]. '
+    "Reply with [] if no search is needed.\n"
+).partial(year=str(CURRENT_YEAR), max_queries=str(MAX_BATCH_QUERIES))
+
+# Each entry point fills in its own system prompt
+COMPOSER_TEMPLATE = PromptTemplate.from_template(
+    "{system_prompt}\n"
+    "Conversation so far:\n{chat_history}\n\n"
+    "User request: {input}\n\n"
+    "Search results:\n{search_results}\n\n"
+    "Using the search results where relevant, write the final recommendation in markdown.\n"
+)
+
+
+class SearchPlanner:
+    """Plan searches, run them as one batch and compose the answer from the results.
+
+    Mixed into the agents, which provide `llm`, `batch_tool` and `composer_prompt`.
+    """
+
+    def _plan(self, user_input: str, chat_history: str, config: dict = None) -> list[SearchStep]:
+        """Ask the LLM for a search plan; raises ValueError if the reply is not one."""
+        raw_plan = self.llm.invoke(PLANNER_PROMPT.format(
+            chat_history=chat_history,
+            input=user_input,
+        ), config=config)
+        # Models often wrap JSON in markdown fences, so pull out the list itself
+        match = re.search(r"\[.*\]", raw_plan, re.DOTALL)
+        if match is None:
+            raise ValueError(f"Planner did not return a JSON list: {raw_plan[:200]}")
+        return search_plan_adapter.validate_json(match.group(0))
+
+    def _compose(self, user_input: str, chat_history: str, plan: list[SearchStep], config: dict = None) -> str:
+        search_results = "No searches were needed."
+        if plan:
+            queries = orjson.dumps([step.query for step in plan]).decode()
+            search_results = self.batch_tool.invoke(queries, config=config)
+
+        # Streaming the answer is what makes the callbacks receive on_llm_new_token
+        return "".join(self.llm.stream(self.composer_prompt.format(
+            chat_history=chat_history,
+            input=user_input,
+            search_results=search_results,
+        ), config=config))
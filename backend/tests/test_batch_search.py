@@ -0,0 +1,19 @@
+import orjson
+from ddgs.exceptions import DDGSException
+
+from search_tools import DDGSearchTool
+
+
+def test_failed_query_does_not_abort_batch(monkeypatch):
+    def fake_search(self, query):
+        if query == "obscure part":
+            raise DDGSException("No results found.")
+        return f"Title: {query} result"
+
+    monkeypatch.setattr(DDGSearchTool, "search", fake_search)
+
+    output = DDGSearchTool().batch_search(orjson.dumps(["budget gpu", "obscure part", "ddr5 ram"]).decode())
+
+    assert "Results for 'budget gpu':\nTitle: budget gpu result" in output
+    assert "Results for 'obscure part':\nNo search results found." in output
+    assert "Results for 'ddr5 ram':\nTitle: ddr5 ram result" in output
@@ -0,0 +1,11 @@
+import os
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_importing_main_does_not_load_torch():
+    # A fresh interpreter, since other tests may already have imported torch
+    code = "import sys, main; assert 'torch' not in sys.modules, 'torch was imported'"
+    subprocess.run([sys.executable, "-c", code], cwd=BACKEND_DIR, check=True)
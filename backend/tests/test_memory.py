@@ -0,0 +1,20 @@
+from langchain.memory import ConversationSummaryBufferMemory
+from langchain_google_genai import ChatGoogleGenerativeAI
+
+from search_tools import GeminiLLM
+
+
+def test_memory_saves_without_counting_tokens_over_rpc(monkeypatch):
+    def count_tokens_rpc(self, text):
+        raise AssertionError("token count went to Gemini")
+
+    monkeypatch.setattr(ChatGoogleGenerativeAI, "get_num_tokens", count_tokens_rpc)
+    llm = GeminiLLM(model="gemini-2.5-flash-lite", google_api_key="test-key")
+    memory = ConversationSummaryBufferMemory(
+        llm=llm, memory_key="chat_history", return_messages=True, max_token_limit=1500
+    )
+
+    memory.save_context({"input": "Build a gaming PC for 50000 INR"}, {"output": "x" * 400})
+
+    assert len(memory.chat_memory.messages) == 2
+    assert 100 <= llm.get_num_tokens_from_messages(memory.chat_memory.messages) < 150
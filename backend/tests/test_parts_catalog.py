@@ -0,0 +1,31 @@
+import pytest
+
+from search_tools import PartsCatalog
+
+
+@pytest.fixture(scope="module")
+def catalog():
+    return PartsCatalog()
+
+
+@pytest.mark.parametrize("query", [
+    "best budget CPU under 10000 INR",
+    "mid range GPU india price",
+    "DDR5 RAM price India 2025",
+    "high end PSU",
+])
+def test_tier_queries_are_answered_from_catalog(catalog, query):
+    assert catalog.lookup(query) is not None
+
+
+@pytest.mark.parametrize("query", [
+    "high end cpu cooler",
+    "budget cpu cooler",
+    "mid range cpu AM5 motherboard",
+    "best SSD 1TB NVMe price India",
+    "Ryzen 5 5600 vs i5 12400 B550 compatibility",
+    "gaming pc 50000",
+    "price in India",
+])
+def test_specific_queries_go_to_web_search(catalog, query):
+    assert catalog.lookup(query) is None
@@ -0,0 +1,22 @@
+import os
+
+import orjson
+
+import main
+
+
+def test_writer_starts_on_first_entry(tmp_path):
+    log_dir = tmp_path / "logs"
+    search_log = main.SearchLog(str(log_dir))
+    assert not log_dir.exists()
+
+    search_log.put({"query": "budget gpu", "results": []})
+    search_log.queue.join()
+
+    [log_file] = os.listdir(log_dir)
+    assert orjson.loads((log_dir / log_file).read_bytes()) == {"query": "budget gpu", "results": []}
+
+
+def test_default_log_dir_does_not_depend_on_cwd():
+    backend_dir = os.path.dirname(os.path.abspath(main.__file__))
+    assert main.search_log.log_dir == os.environ.get("SEARCH_LOG_DIR", os.path.join(backend_dir, "logs"))
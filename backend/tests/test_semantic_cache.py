@@ -0,0 +1,43 @@
+import os
+
+import numpy as np
+
+import main
+
+
+def unit(*values):
+    vector = np.array([values + (0.0,) * (384 - len(values))], dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+def test_hit_requires_the_same_numbers(tmp_path):
+    cache = main.SemanticCache(cache_dir=str(tmp_path))
+    cache.add(unit(1.0), "gaming PC, budget 50000 INR", "build for 50k")
+
+    # Same embedding, so only the budget tells the prompts apart
+    assert cache.lookup(unit(1.0), "gaming PC, budget 150000 INR") is None
+    assert cache.lookup(unit(1.0), "Gaming PC with a budget of 50,000 INR") == "build for 50k"
+
+
+def test_lookup_skips_a_closer_entry_for_another_budget(tmp_path):
+    cache = main.SemanticCache(cache_dir=str(tmp_path))
+    cache.add(unit(1.0), "gaming PC, budget 50000 INR", "build for 50k")
+    cache.add(unit(1.0, 0.2), "gaming PC, budget 150000 INR", "build for 150k")
+
+    assert cache.lookup(unit(1.0, 0.05), "gaming PC, budget 150000 INR") == "build for 150k"
+
+
+def test_entries_survive_a_restart(tmp_path):
+    cache = main.SemanticCache(cache_dir=str(tmp_path))
+    cache.add(unit(1.0), "gaming PC, budget 50000 INR", "build for 50k")
+    cache.save()
+
+    reloaded = main.SemanticCache(cache_dir=str(tmp_path))
+    assert reloaded.lookup(unit(1.0), "gaming PC, budget 150000 INR") is None
+    assert reloaded.lookup(unit(1.0), "gaming PC, budget 50000 INR") == "build for 50k"
+
+
+def test_default_cache_dir_does_not_depend_on_cwd(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    backend_dir = os.path.dirname(os.path.abspath(main.__file__))
+    assert main.SemanticCache().index_path == os.path.join(backend_dir, "cache", "semantic.index")
@@ -0,0 +1,53 @@
+from langchain.memory import ConversationBufferMemory
+from langchain_core.language_models.llms import LLM
+from langchain_core.outputs import GenerationChunk
+
+import main
+
+
+class FakeStreamingLLM(LLM):
+    """Plans no searches and streams a fixed answer word by word."""
+    answer: str
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-streaming"
+
+    def _call(self, prompt, stop=None, run_manager=None, **kwargs):
+        return "[]" if "Plan the web searches" in prompt else self.answer
+
+    def _stream(self, prompt, stop=None, run_manager=None, **kwargs):
+        for word in self.answer.split(" "):
+            chunk = GenerationChunk(text=word + " ")
+            if run_manager:
+                run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+
+
+class ImmediateLoop:
+    def call_soon_threadsafe(self, callback, *args):
+        callback(*args)
+
+
+def test_composed_answer_is_streamed_as_token_events():
+    answer = "Ryzen 5 5600 with an RX 6600 fits a 50000 INR budget."
+    agent = main.PCBuildAgent.__new__(main.PCBuildAgent)
+    agent.llm = FakeStreamingLLM(answer=answer)
+    memory = ConversationBufferMemory(memory_key="chat_history", return_messages=True)
+
+    broadcast = main.EventBroadcast()
+    events = broadcast.subscribe("session", memory)
+    callback = main.AgentStreamingCallback(broadcast, ImmediateLoop(), "session")
+
+    response = agent.invoke("Build a gaming PC for 50000 INR", memory, callbacks=[callback])
+
+    received = []
+    while not events.empty():
+        received.append(events.get_nowait())
+    tokens = [event["content"] for event in received if event["type"] == "token"]
+    # Both the planner and the composer call report to the stream
+    assert [event["type"] for event in received].count("llm_start") == 2
+    assert tokens
+    assert "".join(tokens).strip() == answer
+    assert response["output"].strip() == answer
+    assert response["cacheable"]